@@ -9,25 +9,37 @@ import os
 import sys
 import time
 import logging
+import logging.handlers
 import asyncio
-import threading
+import atexit
+import base64
+import functools
 import signal
-import json
-import subprocess
-from datetime import datetime, timedelta
-from typing import Dict, List, Optional, Any
+import queue
+import threading
+import importlib.util
+from datetime import date, datetime, time as dt_time, timedelta
+from typing import Dict, List, Optional, Set
 from pathlib import Path
 import psutil
 
-# Add current directory to path
-sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
-
 # Import configuration and dependencies
 from dotenv import load_dotenv
-import requests
-from supabase import create_client, Client
+import httpx
+from supabase import create_client, acreate_client, Client
+from postgrest.types import ReturnMethod
 import pytz
 
+# Camera stack (only available on the Raspberry Pi)
+try:
+    from picamera2 import Picamera2
+    from picamera2.encoders import H264Encoder
+    from picamera2.outputs import FfmpegOutput
+    PICAMERA2_IMPORT_ERROR = None
+except ImportError as e:
+    Picamera2 = H264Encoder = FfmpegOutput = None
+    PICAMERA2_IMPORT_ERROR = e
+
 # Load environment variables
 load_dotenv()
 
@@ -45,22 +57,84 @@ class EZRECMain:
     7. Maintain exclusive camera access
     """
     
+    # Processes that compete for the camera (libcamera excluded since we use Picamera2)
+    CONFLICTING_CAMERA_PROCESSES = frozenset({"raspistill", "raspivid", "motion", "fswebcam"})
+    
+    # Fallback storage buckets tried when "videos" rejects the upload
+    ALTERNATIVE_BUCKETS = ("ezrec-videos", "recordings", "camera-recordings")
+    
+    # Booking columns the controller reads; the rest of the row stays server-side
+    BOOKING_COLUMNS = "id,date,start_time,end_time"
+    
+    # Uploads are streamed in chunks so memory stays flat regardless of file size
+    UPLOAD_CHUNK_SIZE = 4 * 1024 * 1024
+    
+    # Resumable (TUS) uploads: Supabase requires 6 MiB chunks; a dropped chunk is retried
+    # from the offset the server confirms instead of restarting the whole file
+    RESUMABLE_CHUNK_SIZE = 6 * 1024 * 1024
+    RESUMABLE_RETRIES = 5
+    
+    # A booking whose recording output keeps failing is restarted with exponential backoff
+    # (2, 4, 8, ... seconds) and given up after RESTART_MAX_ATTEMPTS failures in a row;
+    # a recording that ran RESTART_RESET_AFTER seconds before failing starts a new streak
+    RESTART_MAX_ATTEMPTS = 5
+    RESTART_BASE_DELAY = 2
+    RESTART_RESET_AFTER = 120
+    
     def __init__(self):
         """Initialize EZREC Main Controller"""
-        self.is_running = False
         self.current_booking: Optional[Dict] = None
         self.recording_active = False
-        self.camera_process: Optional[subprocess.Popen] = None
-        self.stop_event = threading.Event()
+        self.picam2 = None  # Long-lived Picamera2 instance, opened once and reused
+        self.encoder = None  # H264 encoder built with the camera and reused for every recording
+        self.current_recording_path: Optional[Path] = None
+        self._recording_failed = False  # set from the encoder thread if ffmpeg dies mid-recording
+        self._recording_started_mono: Optional[float] = None
+        
+        # Failed-output restarts per booking id: (failures in a row, epoch of the earliest restart)
+        self._restart_state: Dict[str, tuple] = {}
+        self._abandoned_bookings: Set[str] = set()
+        self.status_interval = 3
+        self._status_task: Optional[asyncio.Task] = None
+        
+        # Main loop sleeps until the next booking deadline; _wake cuts the sleep short.
+        # _shutdown is the single stop flag, set from the signal handler via the loop
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wake = asyncio.Event()
+        self._shutdown = asyncio.Event()
+        self.booking_check_interval = int(os.getenv("BOOKING_CHECK_INTERVAL", "30"))
+        self.booking_retry_interval = 5  # seconds between refetches after a failed booking fetch
+        self.pre_start_window = 60
+        
+        # Today's bookings, refetched only when Realtime reports a change (or as a safety poll)
+        self.realtime_client = None
+        self._realtime_live = False  # channel currently joined; polling backs off only then
+        self.realtime_safety_interval = int(os.getenv("REALTIME_SAFETY_INTERVAL", "300"))
+        self._bookings_cache: List[Dict] = []
+        self._bookings_fetched_at: Optional[float] = None
+        self._bookings_day_end_ts = 0.0  # epoch of the next local midnight; the cache is per day
+        self._bookings_stale = True
+        
+        # Uploads run as background tasks so the next booking never waits on the network;
+        # shutdown waits for them, but stays inside systemd's TimeoutStopSec
+        self._upload_tasks: Set[asyncio.Task] = set()
+        self.shutdown_upload_timeout = 20
+        
+        # Cancelling an upload task doesn't stop its worker thread; the workers poll this event
+        # between chunks, and shutdown waits for them before closing the shared HTTP client
+        self._uploads_cancelled = threading.Event()
+        self._upload_workers: Set[asyncio.Future] = set()
+        self.shutdown_worker_timeout = 5
         
         # Configuration from environment
         self.base_dir = Path(os.getenv("EZREC_BASE_DIR", "/opt/ezrec-backend"))
         self.recordings_dir = self.base_dir / "recordings"
+        self.partial_dir = self.recordings_dir / ".partial"  # recordings still being written
         self.temp_dir = self.base_dir / "temp"
         self.logs_dir = self.base_dir / "logs"
         
         # Ensure directories exist
-        for directory in [self.recordings_dir, self.temp_dir, self.logs_dir]:
+        for directory in [self.recordings_dir, self.partial_dir, self.temp_dir, self.logs_dir]:
             directory.mkdir(parents=True, exist_ok=True)
         
         # Setup logging
@@ -77,38 +151,78 @@ class EZRECMain:
             "bitrate": int(os.getenv("RECORDING_BITRATE", "10000000"))
         }
         
-        # System status tracking
+        # Booking times are stored in Pi local time (EST); resolve the zone once
+        self.local_tz = pytz.timezone('America/New_York')
+        
+        # System status tracking (uptime_start is serialized, so it stays wall-clock;
+        # durations are measured against the monotonic clock)
+        self.start_monotonic = time.monotonic()
+        started_at = datetime.now().isoformat()
         self.system_status = {
             "orchestrator_status": "initializing",
             "camera_status": "available",
             "current_booking": None,
             "recording_active": False,
-            "last_update": datetime.now().isoformat(),
-            "uptime_start": datetime.now().isoformat(),
+            "last_update": started_at,
+            "uptime_start": started_at,
             "total_recordings": 0,
             "successful_uploads": 0,
             "errors_count": 0,
             "camera_protected": False
         }
         
-        # Setup signal handlers
-        signal.signal(signal.SIGTERM, self._signal_handler)
-        signal.signal(signal.SIGINT, self._signal_handler)
+        # Status write coalescing: only upsert on change, plus a periodic heartbeat
+        self._last_status = None
+        self._last_status_write = 0.0
+        self.status_heartbeat_interval = 30
+        
+        # Last error per recurring operation, so a sustained outage logs once, not every tick
+        self._last_errors: Dict[str, tuple] = {}
+        
+        # Setup signal handlers (moved onto the event loop once it is running)
+        self._install_signal_handlers()
         
         self.logger.info("🎬 EZREC Main Controller initialized")
     
     def setup_logging(self):
         """Setup comprehensive logging"""
-        log_file = self.logs_dir / f"ezrec_{datetime.now().strftime('%Y%m%d')}.log"
-        
-        logging.basicConfig(
-            level=logging.INFO,
-            format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-            handlers=[
-                logging.FileHandler(log_file),
-                logging.StreamHandler(sys.stdout)
-            ]
+        log_file = self.logs_dir / "ezrec.log"
+        log_format = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+        
+        # The format never uses thread/process fields; don't collect them per record
+        logging.logThreads = False
+        logging.logProcesses = False
+        logging.logMultiprocessing = False
+        
+        # Rotate at local midnight and keep two weeks of logs
+        file_handler = logging.handlers.TimedRotatingFileHandler(
+            log_file, when="midnight", backupCount=14, delay=True
         )
+        file_handler.setFormatter(logging.Formatter(log_format))
+        
+        # Buffer file writes to spare the SD card; warnings and errors flush immediately
+        buffered_file_handler = logging.handlers.MemoryHandler(
+            capacity=100,
+            flushLevel=logging.WARNING,
+            target=file_handler
+        )
+        
+        stream_handler = logging.StreamHandler(sys.stdout)
+        stream_handler.setFormatter(logging.Formatter(log_format))
+        
+        # Callers only enqueue records; a listener thread does the file/stdout I/O
+        log_queue = queue.SimpleQueue()
+        self._log_listener = logging.handlers.QueueListener(
+            log_queue, buffered_file_handler, stream_handler, respect_handler_level=True
+        )
+        self._log_listener.start()
+        atexit.register(self._log_listener.stop)  # drain before logging's own shutdown flush
+        
+        # The queue carries pre-rendered messages; the real handlers apply log_format
+        queue_handler = logging.handlers.QueueHandler(log_queue)
+        queue_handler.setFormatter(logging.Formatter('%(message)s'))
+        
+        logging.basicConfig(level=logging.INFO, handlers=[queue_handler])
         
         self.logger = logging.getLogger("EZREC")
     
@@ -121,27 +235,91 @@ class EZRECMain:
             raise ValueError("Missing Supabase configuration")
         
         self.supabase: Client = create_client(url, key)
+        self.supabase_url = url
+        self.supabase_key = key
+        
+        # One pooled keep-alive client for direct storage calls (HTTP/2 when h2 is installed)
+        self.http = httpx.Client(
+            base_url=url,
+            headers={"apikey": key, "Authorization": f"Bearer {key}"},
+            http2=importlib.util.find_spec("h2") is not None,
+            timeout=httpx.Timeout(30.0),
+            limits=httpx.Limits(max_keepalive_connections=8, keepalive_expiry=60)
+        )
         self.user_id = os.getenv("USER_ID")
         self.camera_id = os.getenv("CAMERA_ID", "raspberry_pi_camera_1")
         
         self.logger.info("✅ Supabase client initialized")
     
+    def _log_recurring_error(self, where: str, message: str, error: Exception):
+        """Log an error at ERROR once per streak; identical repeats drop to DEBUG"""
+        key = (type(error), str(error))
+        if self._last_errors.get(where) == key:
+            self.logger.debug("❌ %s (repeated): %s", message, error)
+            return
+        self._last_errors[where] = key
+        self.logger.error("❌ %s: %s", message, error)
+    
+    def _clear_recurring_error(self, where: str):
+        """Note recovery from a streak logged by _log_recurring_error"""
+        if self._last_errors.pop(where, None) is not None:
+            self.logger.info("✅ Recovered: %s", where)
+    
+    def _install_signal_handlers(self, loop: Optional[asyncio.AbstractEventLoop] = None):
+        """Route SIGTERM/SIGINT to shutdown and SIGUSR1 to a status dump"""
+        handlers = (
+            (signal.SIGTERM, self._signal_handler),
+            (signal.SIGINT, self._signal_handler),
+            (signal.SIGUSR1, self._dump_status),
+        )
+        for sig, handler in handlers:
+            if loop is not None:
+                # Runs as a regular loop callback instead of interrupting whatever
+                # coroutine happens to be executing, so shared state is never seen half-updated
+                loop.add_signal_handler(sig, handler, sig, None)
+            else:
+                signal.signal(sig, handler)
+    
     def _signal_handler(self, signum, frame):
         """Handle shutdown signals gracefully"""
         self.logger.info(f"🛑 Received signal {signum}, shutting down...")
-        self.stop_event.set()
-        self.is_running = False
+        self._request_stop()
+    
+    def _dump_status(self, signum=None, frame=None):
+        """Log a status snapshot (SIGUSR1, sent by `systemctl reload`)"""
+        self.logger.info("📊 Status dump: %r", self.system_status)
+    
+    def _request_stop(self):
+        """Flag shutdown and wake the main loop"""
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._shutdown.set)
+            self._loop.call_soon_threadsafe(self._wake.set)
+        else:
+            self._shutdown.set()
+    
+    async def _sleep_unless_shutdown(self, seconds: float):
+        """Sleep for up to `seconds`, returning immediately once shutdown is requested"""
+        try:
+            await asyncio.wait_for(self._shutdown.wait(), seconds)
+        except asyncio.TimeoutError:
+            pass
     
     async def start_main_controller(self):
         """Start the main controller process"""
         try:
             self.logger.info("🚀 Starting EZREC Main Controller...")
-            self.is_running = True
-            self.stop_event.clear()
+            self._loop = asyncio.get_running_loop()
+            self._install_signal_handlers(self._loop)
             
             # Protect camera from other processes
             await self.protect_camera_resources()
             
+            # Get pushed booking changes instead of polling the table
+            await self.subscribe_to_booking_changes()
+            
+            # Retry uploads for recordings left behind by a crash or failed upload
+            await self.recover_pending_recordings()
+            
             # Update initial system status
             await self.update_system_status("running")
             
@@ -161,20 +339,12 @@ class EZRECMain:
         try:
             self.logger.info("🛡️ Protecting camera resources...")
             
-            # Kill any existing camera processes (removed libcamera since we use Picamera2)
-            camera_processes = ["raspistill", "raspivid", "motion", "fswebcam"]
-            for proc_name in camera_processes:
-                try:
-                    subprocess.run(["sudo", "pkill", "-f", proc_name], 
-                                 capture_output=True, check=False)
-                except:
-                    pass
+            # Stop any other processes holding the camera
+            await asyncio.to_thread(self._terminate_conflicting_camera_processes)
             
-            # Check if Picamera2 is available
+            # Open and configure the camera once; holding it keeps access exclusive
             try:
-                from picamera2 import Picamera2
-                test_cam = Picamera2()
-                test_cam.close()
+                self._open_camera()
                 self.system_status["camera_protected"] = True
                 self.system_status["camera_status"] = "available"
                 self.logger.info("✅ Camera protection active - Picamera2 available")
@@ -186,135 +356,379 @@ class EZRECMain:
         except Exception as e:
             self.logger.error(f"❌ Camera protection error: {e}")
     
-    def start_status_updater(self):
-        """Start background status update thread (every 3 seconds)"""
-        def status_loop():
-            while self.is_running and not self.stop_event.is_set():
-                try:
-                    asyncio.run(self.update_system_status_in_db())
-                    time.sleep(3)  # Update every 3 seconds
-                except Exception as e:
-                    self.logger.error(f"❌ Status update error: {e}")
-                    time.sleep(3)
+    def _terminate_conflicting_camera_processes(self, timeout: float = 3):
+        """Terminate known camera users found in one process-table scan, killing stragglers"""
+        own_pid = os.getpid()
+        targets = self.CONFLICTING_CAMERA_PROCESSES
+        victims = []
+        
+        for proc in psutil.process_iter(['pid', 'name', 'cmdline']):
+            try:
+                if proc.info['pid'] == own_pid:
+                    continue
+                cmdline = proc.info['cmdline'] or []
+                if proc.info['name'] in targets or any(os.path.basename(arg) in targets for arg in cmdline):
+                    self.logger.info(f"🛡️ Terminating camera process {proc.info['pid']} ({proc.info['name']})")
+                    proc.terminate()
+                    victims.append(proc)
+            except (psutil.NoSuchProcess, psutil.AccessDenied):
+                continue
+        
+        if not victims:
+            return
         
-        status_thread = threading.Thread(target=status_loop, name="StatusUpdater", daemon=True)
-        status_thread.start()
+        _, alive = psutil.wait_procs(victims, timeout=timeout)
+        for proc in alive:
+            try:
+                proc.kill()
+            except psutil.NoSuchProcess:
+                pass
+    
+    def _open_camera(self):
+        """Open and configure the shared Picamera2 instance (no-op if already open)"""
+        if self.picam2 is not None:
+            return self.picam2
+        
+        if Picamera2 is None:
+            raise ImportError(PICAMERA2_IMPORT_ERROR)
+        
+        self.logger.info("📷 Initializing Picamera2...")
+        picam2 = Picamera2()
+        try:
+            self.logger.info(f"📷 Configuring camera: {self.camera_config['width']}x{self.camera_config['height']} @ {self.camera_config['fps']}fps")
+            config = picam2.create_video_configuration(
+                main={"size": (self.camera_config["width"], self.camera_config["height"])},
+                controls={"FrameRate": self.camera_config["fps"]}
+            )
+            picam2.configure(config)
+            
+            self.logger.info(f"🎞️  Setting up H264 encoder with bitrate: {self.camera_config['bitrate']}")
+            self.encoder = H264Encoder(bitrate=self.camera_config["bitrate"])
+        except Exception:
+            picam2.close()
+            raise
+        
+        self.picam2 = picam2
+        return picam2
+    
+    def _close_camera(self):
+        """Release the shared Picamera2 instance"""
+        if self.picam2 is None:
+            return
+        try:
+            self.picam2.close()
+        except Exception as e:
+            self.logger.error(f"❌ Error closing camera: {e}")
+        self.picam2 = None
+        self.encoder = None
+    
+    def start_status_updater(self):
+        """Start background status update task (every 3 seconds)"""
+        self._status_task = asyncio.create_task(self._status_periodic())
         self.logger.info("✅ Status updater started (3-second intervals)")
     
+    async def _status_periodic(self):
+        """Push a status update every status_interval seconds on the main loop"""
+        loop = asyncio.get_running_loop()
+        next_tick = loop.time()
+        while not self._shutdown.is_set():
+            try:
+                await self.update_system_status_in_db()
+            except Exception as e:
+                self.logger.error(f"❌ Status update error: {e}")
+            
+            # Fixed cadence: the update's own duration doesn't stretch the period,
+            # and ticks missed during a slow update are skipped rather than bunched up
+            next_tick += self.status_interval
+            while next_tick < loop.time():
+                next_tick += self.status_interval
+            await self._sleep_unless_shutdown(next_tick - loop.time())
+    
     async def main_loop(self):
         """Main execution loop"""
         self.logger.info("🔄 Starting main execution loop...")
         
-        while self.is_running and not self.stop_event.is_set():
+        while not self._shutdown.is_set():
             try:
                 # Check for bookings that need to start
-                upcoming_bookings = await self.get_upcoming_bookings()
+                upcoming_bookings = await self.get_cached_bookings()
+                now = datetime.now(self.local_tz)  # one clock read per pass
+                now_ts = now.timestamp()
                 
                 for booking in upcoming_bookings:
-                    if self.should_start_recording(booking):
-                        await self.start_booking_recording(booking)
+                    # Sorted by start: once one is outside the pre-start window, so is the rest
+                    if booking["_start_ts"] - now_ts > self.pre_start_window:
+                        break
+                    if self.should_start_recording(booking, now):
+                        await self.start_booking_recording(booking, now)
                 
                 # Check if current recording should stop
-                if self.current_booking and self.recording_active:
-                    if self.should_stop_recording(self.current_booking):
+                current_booking = self.current_booking
+                if current_booking and self.recording_active:
+                    if self._recording_failed:
+                        # Salvage what was written; the still-active booking is restarted for
+                        # the remainder once its backoff delay has passed
+                        self.logger.warning(f"⚠️  Recording for booking {current_booking.get('id')} failed, stopping it")
+                        restart_pending = await self._note_recording_failure(current_booking)
+                        await self.stop_booking_recording(keep_booking=restart_pending)
+                        self._wake.set()
+                    elif self.should_stop_recording(current_booking, now):
                         await self.stop_booking_recording()
+                        self._restart_state.pop(str(current_booking.get('id')), None)
+                
+                self._clear_recurring_error("main loop")
                 
-                # Brief pause
-                await asyncio.sleep(2)
+                # Sleep until the next start window or stop time
+                await self._sleep_until_next_event(upcoming_bookings)
                 
             except Exception as e:
-                self.logger.error(f"❌ Error in main loop: {e}")
+                self._log_recurring_error("main loop", "Error in main loop", e)
                 self.system_status["errors_count"] += 1
-                await asyncio.sleep(5)
+                await self._sleep_unless_shutdown(5)
+    
+    async def _sleep_until_next_event(self, bookings: List[Dict]):
+        """Sleep until the next booking deadline, the refresh interval, or a wake-up"""
+        timeout = self._seconds_until_next_event(bookings)
+        try:
+            await asyncio.wait_for(self._wake.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        self._wake.clear()
+    
+    def _seconds_until_next_event(self, bookings: List[Dict]) -> float:
+        """Seconds until a pre-start window opens or the current recording should stop"""
+        now_ts = time.time()  # plain epoch arithmetic; no datetime/tz work per wake-up
+        deadlines = []
+        
+        current_booking = self.current_booking
+        if current_booking and self.recording_active:
+            end_ts = current_booking.get("_end_ts")
+            if end_ts:
+                deadlines.append(end_ts - now_ts)
+        else:
+            # Backed-off restarts of failed recordings
+            deadlines.extend(retry_at - now_ts for _, retry_at in self._restart_state.values())
+            for booking in bookings:
+                start_ts = booking.get("_start_ts")
+                if start_ts:
+                    deadline = start_ts - now_ts - self.pre_start_window
+                    deadlines.append(deadline)
+                    if deadline > 0:
+                        break  # sorted by start; later bookings can't be sooner
+        
+        # Wake at midnight to load the new day's bookings
+        deadlines.append(self._bookings_day_end_ts - now_ts)
+        
+        # Re-poll at least every refresh interval so new bookings are seen (sooner while a
+        # failed fetch left the cache stale), and never spin on deadlines that are already due
+        refresh = self._booking_refresh_interval()
+        if self._bookings_stale:
+            refresh = min(refresh, self.booking_retry_interval)
+        future = [d for d in deadlines if d > 0]
+        return max(0.5, min(future + [refresh]))
     
-    async def get_upcoming_bookings(self):
-        """Get bookings that should start soon"""
+    @staticmethod
+    def _booking_ended(booking: Dict) -> bool:
+        """Whether the booking's end time has passed (unknown end counts as ended)"""
+        end_ts = booking.get("_end_ts")
+        return end_ts is None or time.time() >= end_ts
+    
+    def _booking_refresh_interval(self) -> float:
+        """Polling is only a safety net while Realtime is delivering changes"""
+        if self._realtime_live:
+            return self.realtime_safety_interval
+        return self.booking_check_interval
+    
+    @staticmethod
+    @functools.lru_cache(maxsize=256)
+    def _parse_booking_time(value: str):
+        """Parse a booking time in HH:MM:SS or HH:MM format, or return None (memoized: slots repeat)"""
+        try:
+            parsed = dt_time.fromisoformat(value)
+        except (TypeError, ValueError):
+            # fromisoformat needs zero-padded hours; the text column may hold "9:00"
+            for time_format in ('%H:%M:%S', '%H:%M'):
+                try:
+                    return datetime.strptime(value, time_format).time()
+                except (TypeError, ValueError):
+                    continue
+            return None
+        # Times are local wall-clock; reject offsets rather than mixing zones
+        return parsed if parsed.tzinfo is None else None
+    
+    def _enrich_booking(self, booking: Dict) -> Dict:
+        """Parse a booking's date/start/end once; cache as _start_dt/_end_dt and epoch _start_ts/_end_ts"""
+        start = self._parse_booking_time(booking.get("start_time", ""))
+        end = self._parse_booking_time(booking.get("end_time", ""))
+        if start is None or end is None:
+            self.logger.error(f"❌ Invalid time format for booking {booking.get('id')}: "
+                              f"{booking.get('start_time')}-{booking.get('end_time')}")
+            booking["_start_dt"] = booking["_end_dt"] = None
+            booking["_start_ts"] = booking["_end_ts"] = None
+            return booking
+        
+        try:
+            booking_date = date.fromisoformat(booking.get("date", ""))
+        except (TypeError, ValueError):
+            booking_date = datetime.now(self.local_tz).date()
+        
+        booking["_start_dt"] = self.local_tz.localize(datetime.combine(booking_date, start))
+        booking["_end_dt"] = self.local_tz.localize(datetime.combine(booking_date, end))
+        booking["_start_ts"] = booking["_start_dt"].timestamp()
+        booking["_end_ts"] = booking["_end_dt"].timestamp()
+        return booking
+    
+    async def subscribe_to_booking_changes(self):
+        """Subscribe to bookings changes via Supabase Realtime (falls back to polling)"""
+        try:
+            client = await acreate_client(self.supabase_url, self.supabase_key)
+            channel = client.channel(f"ezrec-bookings-{self.camera_id}")
+            channel.on_postgres_changes(
+                "*",
+                schema="public",
+                table="bookings",
+                filter=f"user_id=eq.{self.user_id}",
+                callback=self._on_booking_change
+            )
+            await channel.subscribe(self._on_realtime_state)
+            self.realtime_client = client
+            self.logger.info("✅ Subscribed to booking changes (Realtime)")
+        except Exception as e:
+            self.realtime_client = None
+            self.logger.warning(f"⚠️  Realtime unavailable, polling bookings every {self.booking_check_interval}s: {e}")
+    
+    def _on_realtime_state(self, state, error=None):
+        """Realtime channel state: poll at the normal rate whenever the channel is down"""
+        live = getattr(state, "value", state) == "SUBSCRIBED"
+        if live != self._realtime_live:
+            if live:
+                self.logger.info("✅ Realtime channel joined")
+            else:
+                self.logger.warning(f"⚠️  Realtime channel {getattr(state, 'value', state)}, polling bookings: {error}")
+        self._realtime_live = live
+        # Changes may have been missed while disconnected; refetch and recompute the sleep
+        self._bookings_stale = True
+        self._wake.set()
+    
+    def _on_booking_change(self, payload):
+        """Realtime callback: invalidate the booking cache and wake the main loop"""
+        self._bookings_stale = True
+        self._wake.set()
+    
+    async def get_cached_bookings(self) -> List[Dict]:
+        """Return today's bookings, refetching only when stale or the refresh interval elapsed"""
+        fetched_at = self._bookings_fetched_at
+        if (self._bookings_stale or fetched_at is None
+                or time.time() >= self._bookings_day_end_ts
+                or time.monotonic() - fetched_at >= self._booking_refresh_interval()):
+            # Clear first so a change arriving mid-fetch triggers another refetch
+            self._bookings_stale = False
+            if time.time() >= self._bookings_day_end_ts:
+                # A new day: yesterday's restart bookkeeping can't match any booking
+                self._restart_state.clear()
+                self._abandoned_bookings.clear()
+            self._bookings_day_end_ts = self._next_midnight_ts()
+            bookings = await self.get_upcoming_bookings()
+            if bookings is not None:
+                self._bookings_cache = bookings
+                self._bookings_fetched_at = time.monotonic()
+            # On failure keep the last good list; the stale flag retries it shortly
+        return self._bookings_cache
+    
+    def _next_midnight_ts(self) -> float:
+        """Epoch timestamp of the next local midnight (when today's booking list expires)"""
+        tomorrow = datetime.now(self.local_tz).date() + timedelta(days=1)
+        return self.local_tz.localize(datetime.combine(tomorrow, dt_time())).timestamp()
+    
+    async def get_upcoming_bookings(self) -> Optional[List[Dict]]:
+        """Get bookings that should start soon, or None if the fetch failed"""
         try:
             # Get current time in EST
-            est = pytz.timezone('America/New_York')
-            current_time = datetime.now(est)
-            current_date = current_time.strftime('%Y-%m-%d')
-            current_time_str = current_time.strftime('%H:%M')
+            current_time = datetime.now(self.local_tz)
+            current_date = current_time.date().isoformat()
             
             # Query bookings for today
-            result = self.supabase.table("bookings").select("*").eq("user_id", self.user_id).eq("date", current_date).execute()
+            # Bookings that already ended can't start or stop anything; leave them server-side
+            query = (
+                self.supabase.table("bookings")
+                .select(self.BOOKING_COLUMNS)
+                .eq("user_id", self.user_id)
+                .eq("date", current_date)
+                .gt("end_time", current_time.time().isoformat(timespec="seconds"))
+                .order("start_time")
+            )
+            result = await asyncio.to_thread(query.execute)
             
-            bookings = result.data if result.data else []
-            self.logger.info(f"📋 Found {len(bookings)} bookings for today")
+            # Keep only parseable bookings, in start order; the main loop relies on the ordering
+            bookings = [self._enrich_booking(booking) for booking in result.data or []]
+            bookings = sorted((b for b in bookings if b["_start_dt"] is not None),
+                              key=lambda b: b["_start_dt"])
+            self.logger.info("📋 Found %d remaining bookings for today", len(bookings))
+            self._clear_recurring_error("booking fetch")
             
             return bookings
             
         except Exception as e:
-            self.logger.error(f"❌ Error fetching bookings: {e}")
-            return []
+            self._log_recurring_error("booking fetch", "Error fetching bookings", e)
+            self._bookings_stale = True
+            return None
     
-    def should_start_recording(self, booking: Dict) -> bool:
+    def should_start_recording(self, booking: Dict, now: Optional[datetime] = None) -> bool:
         """Check if recording should start for this booking"""
         try:
+            # Resolve the booking fields once
+            booking_id = booking.get('id')
+            start_ts = booking.get("_start_ts")
+            end_ts = booking.get("_end_ts")
+            
             if self.recording_active:
-                self.logger.debug(f"🔄 Already recording, skipping booking {booking.get('id')}")
+                self.logger.debug("🔄 Already recording, skipping booking %s", booking_id)
                 return False  # Already recording
             
-            est = pytz.timezone('America/New_York')
-            current_time = datetime.now(est)
-            
-            # Parse booking start time (handle both HH:MM and HH:MM:SS formats)
-            start_time_str = booking.get("start_time", "")
-            end_time_str = booking.get("end_time", "")
+            if start_ts is None or end_ts is None:
+                return False
             
-            try:
-                # Try HH:MM:SS format first
-                booking_start = datetime.strptime(start_time_str, "%H:%M:%S").time()
-            except ValueError:
-                try:
-                    # Try HH:MM format
-                    booking_start = datetime.strptime(start_time_str, "%H:%M").time()
-                except ValueError:
-                    self.logger.error(f"❌ Invalid start time format: {start_time_str}")
-                    return False
-
-            try:
-                # Try HH:MM:SS format first for end time
-                booking_end = datetime.strptime(end_time_str, "%H:%M:%S").time()
-            except ValueError:
-                try:
-                    # Try HH:MM format
-                    booking_end = datetime.strptime(end_time_str, "%H:%M").time()
-                except ValueError:
-                    self.logger.error(f"❌ Invalid end time format: {end_time_str}")
-                    return False
+            current_time = now or datetime.now(self.local_tz)
+            now_ts = current_time.timestamp()
             
-            current_time_only = current_time.time()
+            # A failing recording waits out its backoff, and is dropped after too many failures
+            if str(booking_id) in self._abandoned_bookings:
+                return False
+            _, retry_at = self._restart_state.get(str(booking_id), (0, 0.0))
+            if now_ts < retry_at:
+                self.logger.debug("⏳ Restart of %s backed off for %.1fs", booking_id, retry_at - now_ts)
+                return False
             
             # Calculate time differences for debugging
-            start_diff = (datetime.combine(datetime.today(), current_time_only) - 
-                         datetime.combine(datetime.today(), booking_start)).total_seconds()
-            end_diff = (datetime.combine(datetime.today(), current_time_only) - 
-                       datetime.combine(datetime.today(), booking_end)).total_seconds()
+            start_diff = now_ts - start_ts
+            end_diff = now_ts - end_ts
             
-            # Log detailed timing info
-            booking_id = booking.get('id')
-            self.logger.info(f"🕐 Booking {booking_id}: {booking.get('date')} {start_time_str}-{end_time_str}")
-            self.logger.info(f"⏰ Current time: {current_time_only}, Start diff: {start_diff:.1f}s, End diff: {end_diff:.1f}s")
+            # Log detailed timing info (runs per booking per wake-up, so skip the arguments at INFO)
+            if self.logger.isEnabledFor(logging.DEBUG):
+                self.logger.debug("🕐 Booking %s: %s %s-%s", booking_id, booking.get('date'),
+                                  booking.get('start_time'), booking.get('end_time'))
+                self.logger.debug("⏰ Current time: %s, Start diff: %.1fs, End diff: %.1fs",
+                                  current_time.time(), start_diff, end_diff)
             
             # Recording should start if:
             # 1. Current time is within 60 seconds BEFORE the start time (pre-start window)
             # 2. OR current time is BETWEEN start and end time (active period)
-            pre_start_window = -60 <= start_diff <= 0  # Up to 1 minute before start
+            pre_start_window = -self.pre_start_window <= start_diff <= 0  # Up to 1 minute before start
             active_period = start_diff >= 0 and end_diff <= 0  # Between start and end
             
             should_start = pre_start_window or active_period
             
             if should_start:
                 if pre_start_window:
-                    self.logger.info(f"🎬 SHOULD START (Pre-start): {booking_id} starts in {abs(start_diff):.1f}s")
+                    self.logger.info("🎬 SHOULD START (Pre-start): %s starts in %.1fs", booking_id, abs(start_diff))
                 else:
-                    self.logger.info(f"🎬 SHOULD START (Active): {booking_id} started {start_diff:.1f}s ago, ends in {abs(end_diff):.1f}s")
+                    self.logger.info("🎬 SHOULD START (Active): %s started %.1fs ago, ends in %.1fs",
+                                     booking_id, start_diff, abs(end_diff))
             else:
-                if start_diff < -60:
-                    self.logger.debug(f"⏱️  Too early: {booking_id} starts in {abs(start_diff):.1f}s (>60s)")
+                if start_diff < -self.pre_start_window:
+                    self.logger.debug("⏱️  Too early: %s starts in %.1fs (>60s)", booking_id, abs(start_diff))
                 elif end_diff > 0:
-                    self.logger.debug(f"⏱️  Too late: {booking_id} ended {end_diff:.1f}s ago")
+                    self.logger.debug("⏱️  Too late: %s ended %.1fs ago", booking_id, end_diff)
             
             return should_start
             
@@ -322,52 +736,42 @@ class EZRECMain:
             self.logger.error(f"❌ Error checking start time: {e}")
             return False
     
-    def should_stop_recording(self, booking: Dict) -> bool:
+    def should_stop_recording(self, booking: Dict, now: Optional[datetime] = None) -> bool:
         """Check if recording should stop for this booking"""
         try:
-            est = pytz.timezone('America/New_York')
-            current_time = datetime.now(est)
-            
-            # Parse booking end time (handle both formats)
-            end_time_str = booking.get("end_time", "")
-            try:
-                # Try HH:MM:SS format first
-                booking_end = datetime.strptime(end_time_str, "%H:%M:%S").time()
-            except ValueError:
-                try:
-                    # Try HH:MM format
-                    booking_end = datetime.strptime(end_time_str, "%H:%M").time()
-                except ValueError:
-                    self.logger.error(f"❌ Invalid time format: {end_time_str}")
-                    return False
-            
-            current_time_only = current_time.time()
+            booking_end = booking.get("_end_dt")
+            if booking_end is None:
+                return False
             
             # Check if it's time to stop
-            return current_time_only >= booking_end
+            return (now or datetime.now(self.local_tz)) >= booking_end
             
         except Exception as e:
             self.logger.error(f"❌ Error checking stop time: {e}")
             return False
     
-    async def start_booking_recording(self, booking: Dict):
+    async def start_booking_recording(self, booking: Dict, now: Optional[datetime] = None):
         """Start recording for a booking"""
         try:
             self.logger.info(f"🎬 Starting recording for booking: {booking.get('id')}")
             
-            # Generate filename
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            # Generate filename (booking timezone, from the loop's clock snapshot)
+            timestamp = (now or datetime.now(self.local_tz)).strftime("%Y%m%d_%H%M%S")
             filename = f"ezrec_{timestamp}_{booking.get('id', 'unknown')}.mp4"
-            output_path = self.recordings_dir / filename
+            output_path = self.partial_dir / filename
             
             # Start Picamera2 recording
             await self.start_picamera2_recording(str(output_path))
             
             # Update status
             self.current_booking = booking
+            self.current_recording_path = output_path
             self.recording_active = True
             self.system_status["current_booking"] = booking.get('id')
             self.system_status["recording_active"] = True
+            self._recording_started_mono = time.monotonic()
+            if self.system_status["orchestrator_status"] == "error":
+                await self.update_system_status("running")  # recording again after a given-up booking
             
             self.logger.info(f"✅ Recording started: {filename}")
             
@@ -376,47 +780,24 @@ class EZRECMain:
             await self.handle_recording_error(booking, str(e))
     
     async def start_picamera2_recording(self, output_path: str):
-        """Start Picamera2 recording process"""
+        """Start recording on the shared Picamera2 instance"""
         try:
-            from picamera2 import Picamera2
-            from picamera2.encoders import H264Encoder
-            from picamera2.outputs import FileOutput
-            
             # Ensure recordings directory exists
             output_file = Path(output_path)
             output_file.parent.mkdir(parents=True, exist_ok=True)
-            self.logger.info(f"📁 Recordings directory: {output_file.parent}")
             
-            # Initialize camera
-            self.logger.info("📷 Initializing Picamera2...")
-            picam2 = Picamera2()
+            # Reuse the camera opened at startup (reopen if a previous failure released it)
+            picam2 = await asyncio.to_thread(self._open_camera)
             
-            # Configure for recording
-            self.logger.info(f"📷 Configuring camera: {self.camera_config['width']}x{self.camera_config['height']} @ {self.camera_config['fps']}fps")
-            config = picam2.create_video_configuration(
-                main={"size": (self.camera_config["width"], self.camera_config["height"])},
-                controls={"FrameRate": self.camera_config["fps"]}
-            )
-            picam2.configure(config)
+            # The hardware H264 stream is muxed straight into a fragmented MP4: the moov atom is
+            # written up front and every keyframe starts a fragment, so a killed ffmpeg still
+            # leaves a playable file. FfmpegOutput splits this string into ffmpeg's output args.
+            output = FfmpegOutput(f"-movflags +frag_keyframe+empty_moov {output_path}")
+            output.error_callback = self._on_recording_error
+            self._recording_failed = False
             
-            # Setup encoder
-            self.logger.info(f"🎞️  Setting up H264 encoder with bitrate: {self.camera_config['bitrate']}")
-            encoder = H264Encoder(bitrate=self.camera_config["bitrate"])
-            output = FileOutput(output_path)
-            
-            # Start camera first
-            self.logger.info("📷 Starting camera...")
-            picam2.start()
-            
-            # Brief delay to ensure camera is ready
-            await asyncio.sleep(0.5)
-            
-            # Start recording
-            self.logger.info(f"🎬 Starting recording to: {output_path}")
-            picam2.start_recording(encoder, output)
-            
-            # Store camera reference for stopping
-            self.camera_process = picam2
+            # Start recording (starts the camera as well)
+            await asyncio.to_thread(picam2.start_recording, self.encoder, output)
             
             # Verify file is being created
             await asyncio.sleep(1)  # Give it a second to start writing
@@ -425,66 +806,81 @@ class EZRECMain:
             else:
                 self.logger.warning(f"⚠️  Recording file not yet visible: {output_path}")
             
-            self.logger.info(f"✅ Picamera2 recording started successfully")
-            
         except ImportError as e:
             self.logger.error(f"❌ Picamera2 import failed - install required: {e}")
             raise
         except Exception as e:
             self.logger.error(f"❌ Picamera2 recording failed: {e}")
-            # Clean up camera if initialization failed
-            try:
-                if 'picam2' in locals():
-                    picam2.close()
-            except:
-                pass
+            # Release the camera so the next recording starts from a clean open
+            self._close_camera()
             raise
     
-    async def stop_booking_recording(self):
-        """Stop current recording and process"""
+    async def _note_recording_failure(self, booking: Dict) -> bool:
+        """Count a failed recording output: back off the restart (True), or give up on the booking (False)"""
+        booking_id = str(booking.get('id'))
+        failures, _ = self._restart_state.get(booking_id, (0, 0.0))
+        started = self._recording_started_mono
+        if started is not None and time.monotonic() - started >= self.RESTART_RESET_AFTER:
+            failures = 0  # it ran cleanly for a while; this starts a new streak
+        failures += 1
+        
+        if failures >= self.RESTART_MAX_ATTEMPTS:
+            self._restart_state.pop(booking_id, None)
+            self._abandoned_bookings.add(booking_id)
+            message = f"Recording for booking {booking_id} failed {failures} times in a row, giving up"
+            self.logger.error(f"❌ {message}")
+            self.system_status["errors_count"] += 1
+            await self.update_system_status("error", message)
+            return False
+        
+        delay = self.RESTART_BASE_DELAY * 2 ** (failures - 1)
+        self._restart_state[booking_id] = (failures, time.time() + delay)
+        self.logger.warning(f"⚠️  Restarting booking {booking_id} in {delay}s "
+                            f"(failure {failures}/{self.RESTART_MAX_ATTEMPTS})")
+        return True
+    
+    def _on_recording_error(self, error):
+        """FfmpegOutput error callback (encoder thread): wake the loop instead of waiting for end time"""
+        self.logger.error(f"❌ Recording output failed: {error}")
+        self._recording_failed = True
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._wake.set)
+    
+    async def stop_booking_recording(self, keep_booking: bool = False):
+        """Stop current recording and process (keep_booking: a restart will record the rest)"""
         try:
-            if not self.recording_active or not self.current_booking:
+            booking = self.current_booking
+            if not self.recording_active or not booking:
                 return
             
-            self.logger.info(f"🛑 Stopping recording for booking: {self.current_booking.get('id')}")
+            booking_id = booking.get('id')
+            self.logger.info(f"🛑 Stopping recording for booking: {booking_id}")
             
-            # Stop camera recording
-            if self.camera_process:
+            # Stop camera recording; flushing the encoder and ffmpeg runs off the event loop
+            if self.picam2:
                 try:
-                    self.camera_process.stop_recording()
-                    self.camera_process.close()
-                    self.camera_process = None
+                    await asyncio.to_thread(self.picam2.stop_recording)
                     self.logger.info("✅ Camera recording stopped")
                 except Exception as e:
                     self.logger.error(f"❌ Error stopping camera: {e}")
+                    self._close_camera()
             
-            # Find the recording file
-            booking_id = self.current_booking.get('id')
-            self.logger.info(f"🔍 Looking for recording files: *{booking_id}*.mp4 in {self.recordings_dir}")
-            
-            # List all files in recordings directory for debugging
-            all_files = list(self.recordings_dir.glob("*.mp4"))
-            self.logger.info(f"📁 All MP4 files in recordings dir: {[f.name for f in all_files]}")
-            
-            recording_files = list(self.recordings_dir.glob(f"*{booking_id}*.mp4"))
-            self.logger.info(f"📁 Matching recording files: {[f.name for f in recording_files]}")
+            # The output path was fixed when the recording started
+            recording_path = self.current_recording_path
+            if recording_path is not None:
+                try:
+                    # Publish the finished file out of .partial/ atomically (no separate exists() check)
+                    recording_path = await asyncio.to_thread(self._finalize_recording, recording_path)
+                except FileNotFoundError:
+                    recording_path = None
             
-            if recording_files:
-                recording_path = recording_files[0]
-                self.logger.info(f"✅ Found recording file: {recording_path}")
-                
-                # Process the completed recording
-                await self.process_completed_recording(self.current_booking, str(recording_path))
+            if recording_path:
+                # Upload in the background; the next booking can start right away
+                self._start_upload_task(self.process_completed_recording(booking, str(recording_path), keep_booking))
             else:
-                # Check if any files were created
-                if all_files:
-                    # Use the most recent file as fallback
-                    latest_file = max(all_files, key=lambda f: f.stat().st_mtime)
-                    self.logger.warning(f"⚠️  No matching file found, using latest: {latest_file}")
-                    await self.process_completed_recording(self.current_booking, str(latest_file))
-                else:
-                    self.logger.error("❌ No recording files found at all - camera recording likely failed")
-                    # Still remove the booking to prevent infinite loops
+                self.logger.error(f"❌ Recording file not found ({self.current_recording_path}) - camera recording likely failed")
+                # Still remove the booking to prevent infinite loops, unless a restart is pending
+                if not keep_booking:
                     await self.remove_booking(booking_id)
             
             # Update status
@@ -495,6 +891,8 @@ class EZRECMain:
             
             # Clear current booking
             self.current_booking = None
+            self.current_recording_path = None
+            self._recording_failed = False
             
             self.logger.info("✅ Recording stopped and processed")
             
@@ -503,9 +901,104 @@ class EZRECMain:
             # Clear state to prevent infinite loops
             self.recording_active = False
             self.current_booking = None
+            self.current_recording_path = None
+            self._recording_failed = False
+    
+    def _finalize_recording(self, partial_path: Path) -> Path:
+        """fsync a finished recording and atomically move it from .partial/ into recordings/"""
+        with open(partial_path, 'rb') as file:
+            os.fsync(file.fileno())
+        
+        final_path = self.recordings_dir / partial_path.name
+        os.replace(partial_path, final_path)
+        
+        # Persist the rename itself
+        dir_fd = os.open(self.recordings_dir, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+        return final_path
+    
+    @staticmethod
+    def _booking_id_from_filename(filename: str) -> Optional[str]:
+        """Extract the booking id from ezrec_<YYYYmmdd>_<HHMMSS>_<booking_id>.mp4"""
+        parts = Path(filename).stem.split("_", 3)
+        return parts[3] if len(parts) == 4 else None
     
-    async def process_completed_recording(self, booking: Dict, recording_path: str):
-        """Process completed recording: upload and cleanup"""
+    async def recover_pending_recordings(self):
+        """Queue uploads for recordings that survived a crash or a failed upload"""
+        try:
+            # Done before the main loop runs, so no live recording is in .partial/ yet
+            for partial in sorted(self.partial_dir.glob("*.mp4")):
+                self.logger.warning(f"⚠️  Recovering interrupted recording (may be truncated): {partial.name}")
+                await asyncio.to_thread(self._finalize_recording, partial)
+            
+            pending = sorted(self.recordings_dir.glob("*.mp4"))
+            if pending:
+                self._start_upload_task(self._upload_pending_recordings(pending))
+        except Exception as e:
+            self.logger.error(f"❌ Failed to recover pending recordings: {e}")
+    
+    async def _upload_pending_recordings(self, recordings: List[Path]):
+        """Upload recovered recordings, including pre-crash fragments of still-running bookings"""
+        try:
+            # Look all referenced bookings up in a single query
+            booking_ids = {self._booking_id_from_filename(r.name) for r in recordings} - {None}
+            bookings_by_id = {}
+            if booking_ids:
+                query = self.supabase.table("bookings").select(self.BOOKING_COLUMNS).in_("id", sorted(booking_ids))
+                result = await asyncio.to_thread(query.execute)
+                bookings_by_id = {str(b["id"]): self._enrich_booking(b) for b in result.data or []}
+            
+            for recording in recordings:
+                booking_id = self._booking_id_from_filename(recording.name)
+                booking = bookings_by_id.get(booking_id)
+                if booking is None:
+                    self.logger.warning(f"⚠️  No booking found for pending recording {recording.name}, leaving it in place")
+                    continue
+                
+                # A booking that is still running keeps its row: the remainder is recorded in
+                # this session, and that recording deletes it
+                self.logger.info(f"🔄 Retrying upload for pending recording: {recording.name}")
+                await self.process_completed_recording(booking, str(recording),
+                                                       keep_booking=not self._booking_ended(booking))
+                
+        except Exception as e:
+            self.logger.error(f"❌ Failed to recover pending recordings: {e}")
+    
+    def _start_upload_task(self, coro):
+        """Run an upload coroutine in the background, tracked for shutdown"""
+        task = asyncio.create_task(coro)
+        self._upload_tasks.add(task)
+        task.add_done_callback(self._upload_tasks.discard)
+        return task
+    
+    async def _wait_for_uploads(self):
+        """Let in-flight uploads finish; unfinished files are retried on next start"""
+        if not self._upload_tasks:
+            return
+        self.logger.info(f"⏳ Waiting for {len(self._upload_tasks)} upload(s) to finish...")
+        done, pending = await asyncio.wait(self._upload_tasks, timeout=self.shutdown_upload_timeout)
+        if pending:
+            # Stop the worker threads first; cancelling the tasks alone leaves them sending
+            self._uploads_cancelled.set()
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+            self.logger.warning(f"⚠️  {len(pending)} upload(s) interrupted, will retry on next start")
+    
+    async def _wait_for_upload_workers(self) -> bool:
+        """Wait for upload threads to return after cancellation; False if one is still running"""
+        if not self._upload_workers:
+            return True
+        _, running = await asyncio.wait(self._upload_workers, timeout=self.shutdown_worker_timeout)
+        if running:
+            self.logger.warning(f"⚠️  {len(running)} upload thread(s) still finishing a request")
+        return not running
+    
+    async def process_completed_recording(self, booking: Dict, recording_path: str, keep_booking: bool = False):
+        """Process completed recording: upload and cleanup (keep_booking: more of it is still to be recorded)"""
         try:
             self.logger.info(f"📤 Processing completed recording: {recording_path}")
             
@@ -513,11 +1006,14 @@ class EZRECMain:
             upload_success = await self.upload_video_to_storage(booking, recording_path)
             
             if upload_success:
-                # Remove booking from table
-                await self.remove_booking(booking.get('id'))
-                
-                # Delete local file
-                await self.cleanup_local_recording(recording_path)
+                # Dropping the booking and the local file are independent once the upload landed.
+                # The booking must outlive a failed upload: recovery needs it to re-file the video.
+                # An in-session fragment (failed output, crash recovery) keeps the booking so the
+                # rest is still recorded; once shutting down, nothing will record it, so drop it.
+                cleanup = [self.cleanup_local_recording(recording_path)]
+                if not keep_booking or self._shutdown.is_set():
+                    cleanup.append(self.remove_booking(booking.get('id')))
+                await asyncio.gather(*cleanup)
                 
                 self.system_status["successful_uploads"] += 1
                 self.logger.info("✅ Recording processed successfully")
@@ -527,28 +1023,37 @@ class EZRECMain:
         except Exception as e:
             self.logger.error(f"❌ Error processing recording: {e}")
     
+    def _storage_path(self, booking: Dict, filename: str) -> str:
+        """Bucket path for a recording, filed under the day the booking took place"""
+        recorded_on = booking.get("_start_dt") or datetime.now(self.local_tz)
+        return f"recordings/{recorded_on:%Y/%m/%d}/{filename}"
+    
     async def upload_video_to_storage(self, booking: Dict, recording_path: str) -> bool:
         """Upload video to Supabase storage and create video record"""
         try:
             recording_file = Path(recording_path)
-            if not recording_file.exists():
+            try:
+                file_size = recording_file.stat().st_size  # one stat: existence and size
+            except FileNotFoundError:
                 self.logger.error(f"❌ Recording file not found: {recording_path}")
                 return False
-            
-            file_size = recording_file.stat().st_size
+
             self.logger.info(f"📁 Found recording file: {recording_file.name} ({file_size} bytes)")
             
             # Generate storage path
-            timestamp = datetime.now().strftime("%Y/%m/%d")
-            storage_path = f"recordings/{timestamp}/{recording_file.name}"
+            storage_path = self._storage_path(booking, recording_file.name)
             self.logger.info(f"📤 Uploading to storage path: {storage_path}")
             
+            # Probe the duration while the upload runs; it's only needed for the video record
+            duration_task = asyncio.create_task(self.get_video_duration(recording_path))
+            
             # Upload to storage bucket
             try:
-                with open(recording_path, 'rb') as file:
-                    self.logger.info("📤 Starting file upload to Supabase storage...")
-                    result = self.supabase.storage.from_("videos").upload(storage_path, file)
-                    self.logger.info(f"📤 Upload result: {result}")
+                self.logger.info("📤 Starting file upload to Supabase storage...")
+                result = await self._run_upload_worker(
+                    self._upload_file, "videos", storage_path, recording_path, file_size
+                )
+                self.logger.info(f"📤 Upload result: {result}")
                 
                 if result:
                     self.logger.info("✅ File uploaded successfully to storage")
@@ -570,7 +1075,7 @@ class EZRECMain:
                         "filename": recording_file.name,
                         "file_url": public_url,
                         "file_size": file_size,
-                        "duration_seconds": None,  # Could be calculated if needed
+                        "duration_seconds": await duration_task,
                         "recording_date": booking.get("date"),
                         "recording_start_time": booking.get("start_time"),
                         "recording_end_time": booking.get("end_time"),
@@ -578,15 +1083,18 @@ class EZRECMain:
                         "storage_path": storage_path
                     }
                     
-                    self.logger.info(f"💾 Creating video record in database: {video_data}")
-                    video_result = self.supabase.table("videos").insert(video_data).execute()
-                    
-                    if video_result.data:
-                        self.logger.info(f"✅ Video uploaded and recorded: {storage_path}")
-                        return True
-                    else:
-                        self.logger.error(f"❌ Failed to create video record: {video_result}")
+                    self.logger.info(f"💾 Creating video record in database: {storage_path}")
+                    self.logger.debug("💾 Video record: %s", video_data)
+                    # Nothing is read back, so don't have PostgREST echo the row
+                    query = self.supabase.table("videos").insert(video_data, returning=ReturnMethod.minimal)
+                    try:
+                        await asyncio.to_thread(query.execute)
+                    except Exception as e:
+                        self.logger.error(f"❌ Failed to create video record: {e}")
                         return False
+                    
+                    self.logger.info(f"✅ Video uploaded and recorded: {storage_path}")
+                    return True
                 else:
                     self.logger.error(f"❌ Failed to upload to storage: {result}")
                     return False
@@ -595,30 +1103,213 @@ class EZRECMain:
                 self.logger.error(f"❌ Storage upload error: {upload_error}")
                 
                 # Try alternative storage bucket names in case "videos" doesn't exist
-                alternative_buckets = ["ezrec-videos", "recordings", "camera-recordings"]
-                for bucket_name in alternative_buckets:
+                for bucket_name in self.ALTERNATIVE_BUCKETS:
                     try:
                         self.logger.info(f"🔄 Trying alternative bucket: {bucket_name}")
-                        with open(recording_path, 'rb') as file:
-                            result = self.supabase.storage.from_(bucket_name).upload(storage_path, file)
+                        result = await self._run_upload_worker(
+                            self._upload_file, bucket_name, storage_path, recording_path, file_size
+                        )
                         if result:
                             self.logger.info(f"✅ Successfully uploaded to {bucket_name}")
                             public_url = f"https://iszmsaayxpdrovealrrp.supabase.co/storage/v1/object/public/{bucket_name}/{storage_path}"
                             return True
                     except Exception as alt_error:
-                        self.logger.debug(f"❌ Alternative bucket {bucket_name} failed: {alt_error}")
+                        self.logger.debug("❌ Alternative bucket %s failed: %s", bucket_name, alt_error)
                         continue
                 
                 return False
+            finally:
+                duration_task.cancel()  # no-op once awaited
                 
         except Exception as e:
             self.logger.error(f"❌ Upload error: {e}")
             return False
     
+    async def get_video_duration(self, recording_path: str) -> Optional[float]:
+        """Duration in seconds via ffprobe (async subprocess), or None if unavailable or unreadable"""
+        try:
+            proc = await asyncio.create_subprocess_exec(
+                "ffprobe", "-v", "error", "-show_entries", "format=duration",
+                "-of", "default=noprint_wrappers=1:nokey=1", recording_path,
+                stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+            )
+        except FileNotFoundError:
+            self.logger.debug("ffprobe not installed, skipping duration")
+            return None
+        except OSError as e:
+            # Never let a probe failure look like an upload failure to the caller
+            self.logger.warning(f"⚠️  Could not run ffprobe: {e}")
+            return None
+        
+        try:
+            stdout, stderr = await asyncio.wait_for(proc.communicate(), 10)
+        except asyncio.TimeoutError:
+            proc.kill()
+            await proc.wait()
+            self.logger.warning(f"⚠️  ffprobe timed out on {recording_path}")
+            return None
+        except asyncio.CancelledError:
+            proc.kill()
+            await proc.wait()
+            raise
+        
+        # The same probe doubles as the integrity check: an MP4 whose moov atom was never
+        # written (ffmpeg killed mid-recording) fails here even though its size is non-zero
+        if proc.returncode != 0:
+            self.logger.warning(f"⚠️  Recording may be truncated/unplayable: {recording_path} "
+                                f"(ffprobe: {stderr.decode(errors='replace').strip()[:200]})")
+            return None
+        try:
+            return round(float(stdout.decode().strip()), 2)
+        except ValueError:
+            self.logger.warning(f"⚠️  Could not read duration of {recording_path}")
+            return None
+    
+    async def _run_upload_worker(self, func, *args):
+        """Run a blocking upload in the default executor, tracked so shutdown can wait for the thread"""
+        worker = asyncio.get_running_loop().run_in_executor(None, functools.partial(func, *args))
+        self._upload_workers.add(worker)
+        worker.add_done_callback(self._upload_worker_done)
+        # Shielded: cancelling the task must not mark the worker done while its thread still runs
+        return await asyncio.shield(worker)
+    
+    def _upload_worker_done(self, worker: asyncio.Future):
+        """Forget a finished worker; its error was already raised to the task, if one still waited"""
+        self._upload_workers.discard(worker)
+        if not worker.cancelled():
+            worker.exception()  # retrieved, so an abandoned worker's error isn't logged as unhandled
+    
+    def _check_upload_cancelled(self):
+        """Abort a blocking upload between chunks once shutdown gave up on it"""
+        if self._uploads_cancelled.is_set():
+            raise InterruptedError("upload interrupted by shutdown")
+    
+    def _upload_file(self, bucket: str, storage_path: str, recording_path: str, file_size: int) -> bool:
+        """Upload resumably when the storage server supports TUS, else in one streamed request"""
+        self._check_upload_cancelled()
+        upload_url = self._create_resumable_upload(bucket, storage_path, file_size)
+        if upload_url is None:
+            return self._stream_upload(bucket, storage_path, recording_path, file_size)
+        return self._send_resumable_upload(upload_url, recording_path, file_size)
+    
+    def _create_resumable_upload(self, bucket: str, storage_path: str, file_size: int) -> Optional[str]:
+        """Create a TUS upload and return its URL, or None if the endpoint isn't available"""
+        metadata = {
+            "bucketName": bucket,
+            "objectName": storage_path,
+            "contentType": "video/mp4",
+            "cacheControl": "3600",
+        }
+        response = self.http.post(
+            "/storage/v1/upload/resumable",
+            headers={
+                "Tus-Resumable": "1.0.0",
+                "Upload-Length": str(file_size),
+                "Upload-Metadata": ",".join(
+                    f"{key} {base64.b64encode(value.encode()).decode()}" for key, value in metadata.items()
+                ),
+                # Re-uploads after a crash overwrite the partial object instead of failing
+                "x-upsert": "true",
+            }
+        )
+        if response.status_code in (404, 405):
+            self.logger.debug("Resumable uploads not supported, streaming in one request")
+            return None
+        response.raise_for_status()
+        return response.headers["Location"]
+    
+    def _send_resumable_upload(self, upload_url: str, recording_path: str, file_size: int) -> bool:
+        """PATCH the file in RESUMABLE_CHUNK_SIZE pieces, resuming from the server's offset on errors"""
+        tus_headers = {"Tus-Resumable": "1.0.0"}
+        offset = 0
+        failures = 0
+        with open(recording_path, 'rb', buffering=0) as file:
+            fd = file.fileno()
+            fadvise = getattr(os, "posix_fadvise", None)
+            while offset < file_size:
+                self._check_upload_cancelled()
+                chunk = os.pread(fd, self.RESUMABLE_CHUNK_SIZE, offset)
+                try:
+                    response = self.http.patch(
+                        upload_url,
+                        content=chunk,
+                        headers={
+                            **tus_headers,
+                            "Upload-Offset": str(offset),
+                            "Content-Type": "application/offset+octet-stream",
+                        }
+                    )
+                    response.raise_for_status()
+                    new_offset = int(response.headers["Upload-Offset"])
+                    if new_offset <= offset:
+                        # A 2xx that stored nothing would otherwise loop forever
+                        raise ValueError(f"server did not advance Upload-Offset ({new_offset})")
+                except (httpx.TransportError, httpx.HTTPStatusError, KeyError, ValueError) as e:
+                    failures += 1
+                    if failures > self.RESUMABLE_RETRIES:
+                        raise
+                    self.logger.warning(f"⚠️  Upload chunk at {offset} failed ({e}), resuming (attempt {failures})")
+                    # Backoff that ends early at shutdown instead of holding up the executor
+                    if self._uploads_cancelled.wait(min(30, 2 ** failures)):
+                        self._check_upload_cancelled()
+                    # Ask the server how much it actually stored before resending
+                    try:
+                        head = self.http.head(upload_url, headers=tus_headers)
+                        head.raise_for_status()
+                        offset = int(head.headers["Upload-Offset"])
+                    except (httpx.TransportError, httpx.HTTPStatusError, KeyError, ValueError):
+                        pass
+                    continue
+                
+                # Sent pages won't be read again; keep them from crowding the page cache
+                if fadvise:
+                    fadvise(fd, offset, new_offset - offset, os.POSIX_FADV_DONTNEED)
+                offset = new_offset
+                failures = 0
+        return True
+    
+    def _stream_upload(self, bucket: str, storage_path: str, recording_path: str, file_size: int) -> bool:
+        """Stream a file to a storage bucket chunk by chunk (blocking; run via to_thread)"""
+        response = self.http.post(
+            f"/storage/v1/object/{bucket}/{storage_path}",
+            content=self._iter_file_chunks(recording_path),
+            headers={
+                "Content-Type": "video/mp4",
+                "Content-Length": str(file_size),
+                "Cache-Control": "max-age=3600",
+                # A retried upload may find its object already stored; overwrite it like TUS does
+                "x-upsert": "true"
+            }
+        )
+        response.raise_for_status()
+        return True
+    
+    def _iter_file_chunks(self, path: str):
+        """Yield a file's contents in UPLOAD_CHUNK_SIZE pieces"""
+        # Unbuffered: each chunk is read straight into its bytes object
+        with open(path, 'rb', buffering=0) as file:
+            fd = file.fileno()
+            fadvise = getattr(os, "posix_fadvise", None)
+            if fadvise:
+                fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+            offset = 0
+            while True:
+                self._check_upload_cancelled()
+                chunk = file.read(self.UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                yield chunk
+                # Sent pages won't be read again; keep them from crowding the page cache
+                if fadvise:
+                    fadvise(fd, offset, len(chunk), os.POSIX_FADV_DONTNEED)
+                offset += len(chunk)
+    
     async def remove_booking(self, booking_id: str):
         """Remove booking from bookings table"""
         try:
-            result = self.supabase.table("bookings").delete().eq("id", booking_id).execute()
+            query = self.supabase.table("bookings").delete(returning=ReturnMethod.minimal).eq("id", booking_id)
+            await asyncio.to_thread(query.execute)
+            self._bookings_stale = True
             self.logger.info(f"✅ Booking removed: {booking_id}")
         except Exception as e:
             self.logger.error(f"❌ Failed to remove booking {booking_id}: {e}")
@@ -626,7 +1317,8 @@ class EZRECMain:
     async def cleanup_local_recording(self, recording_path: str):
         """Delete local recording file after successful upload"""
         try:
-            Path(recording_path).unlink()
+            # Unlinking a multi-GB file on the SD card can block for a while; keep it off the loop
+            await asyncio.to_thread(Path(recording_path).unlink, missing_ok=True)
             self.logger.info(f"✅ Local file deleted: {recording_path}")
         except Exception as e:
             self.logger.error(f"❌ Failed to delete local file: {e}")
@@ -645,8 +1337,8 @@ class EZRECMain:
         if error:
             self.system_status["last_error"] = error
     
-    async def update_system_status_in_db(self):
-        """Update system status in database (every 3 seconds)"""
+    async def update_system_status_in_db(self, force: bool = False):
+        """Update system status in database (every 3 seconds; force bypasses coalescing)"""
         try:
             status_data = {
                 "user_id": self.user_id,
@@ -654,7 +1346,6 @@ class EZRECMain:
                 "status": self.system_status["orchestrator_status"],
                 "is_recording": self.recording_active,
                 "current_booking_id": self.system_status.get("current_booking"),
-                "last_heartbeat": datetime.now().isoformat(),
                 "total_recordings": self.system_status["total_recordings"],
                 "successful_uploads": self.system_status["successful_uploads"],
                 "errors_count": self.system_status["errors_count"],
@@ -662,24 +1353,78 @@ class EZRECMain:
                 "uptime_start": self.system_status["uptime_start"]
             }
             
+            # Skip the round-trip when nothing changed, except for the periodic heartbeat
+            status_tuple = tuple(status_data.values())
+            now_mono = time.monotonic()
+            if (not force and status_tuple == self._last_status
+                    and now_mono - self._last_status_write < self.status_heartbeat_interval):
+                return
+            status_data["last_heartbeat"] = datetime.now().isoformat()
+            
             # Upsert system status
-            result = self.supabase.table("system_status").upsert(status_data, on_conflict="user_id,camera_id").execute()
+            query = self.supabase.table("system_status").upsert(
+                status_data, on_conflict="user_id,camera_id", returning=ReturnMethod.minimal
+            )
+            await asyncio.to_thread(query.execute)
+            self._last_status = status_tuple
+            self._last_status_write = now_mono
+            self._clear_recurring_error("status update")
             
         except Exception as e:
-            self.logger.error(f"❌ Failed to update system status: {e}")
+            self._log_recurring_error("status update", "Failed to update system status", e)
+    
+    async def _close_realtime(self):
+        """Leave the Realtime channel and close its socket"""
+        if self.realtime_client is None:
+            return
+        try:
+            await self.realtime_client.remove_all_channels()
+        except Exception as e:
+            self.logger.warning(f"⚠️  Failed to close Realtime channel: {e}")
+        self.realtime_client = None
+        self._realtime_live = False
+    
+    async def _remove_kept_bookings(self):
+        """At shutdown, drop bookings kept for a restart that will now never happen"""
+        for booking_id in list(self._restart_state):
+            # A fragment still on disk is retried on next start, and recovery needs its booking
+            if any(self.recordings_dir.glob(f"*_{booking_id}.mp4")) or any(self.partial_dir.glob(f"*_{booking_id}.mp4")):
+                continue
+            await self.remove_booking(booking_id)
+        self._restart_state.clear()
     
     async def stop_controller(self):
         """Gracefully stop the controller"""
         self.logger.info("🛑 Stopping EZREC Controller...")
-        self.is_running = False
-        self.stop_event.set()
+        self._request_stop()
+        
+        if self._status_task is not None:
+            self._status_task.cancel()
+            try:
+                await self._status_task
+            except asyncio.CancelledError:
+                pass
+            self._status_task = None
         
         # Stop any active recording
         if self.recording_active:
             await self.stop_booking_recording()
         
+        self._close_camera()
+        
+        # Independent teardown steps share one time budget instead of running back to back
+        await asyncio.gather(self._wait_for_uploads(), self._close_realtime())
+        await self._remove_kept_bookings()
+        # Closing the client under a worker mid-request fails it unpredictably; a worker that
+        # is still sending returns at its next chunk check, and the client is freed at exit
+        if await self._wait_for_upload_workers():
+            self.http.close()
+        
+        # The status task is gone by now; publish the final state exactly once
         await self.update_system_status("stopped")
-        self.logger.info("✅ Controller stopped")
+        await self.update_system_status_in_db(force=True)
+        uptime = time.monotonic() - self.start_monotonic
+        self.logger.info(f"✅ Controller stopped (uptime: {uptime:.1f}s)")
 
 async def main():
     """Main entry point"""
@@ -688,11 +1433,15 @@ async def main():
     try:
         await controller.start_main_controller()
     except KeyboardInterrupt:
-        await controller.stop_controller()
+        pass
     except Exception as e:
         logging.error(f"❌ Fatal error: {e}")
         await controller.stop_controller()
         sys.exit(1)
+    
+    # main_loop returns as soon as a shutdown signal is handled; finish the
+    # shutdown here instead of leaving an active recording behind
+    await controller.stop_controller()
 
 if __name__ == "__main__":
     asyncio.run(main())
@@ -0,0 +1,6 @@
+-- Index for the Pi's booking poll in main.py (get_upcoming_bookings):
+--   WHERE user_id = ? AND date = ? AND end_time > ? ORDER BY start_time
+-- The equality columns lead so each poll reads only today's rows for this user,
+-- already in start_time order.
+CREATE INDEX IF NOT EXISTS bookings_user_date_start_idx
+    ON public.bookings (user_id, date, start_time);
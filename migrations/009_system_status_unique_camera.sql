@@ -0,0 +1,5 @@
+-- main.py and system_status.py write status with a single upsert
+-- (on_conflict="user_id,camera_id"); PostgREST needs a unique index on exactly
+-- those columns to resolve the conflict.
+CREATE UNIQUE INDEX IF NOT EXISTS system_status_user_camera_key
+    ON public.system_status (user_id, camera_id);
@@ -8,13 +8,25 @@ import os
 import sys
 import time
 import logging
+import logging.handlers
 import asyncio
+import atexit
+import queue
 from datetime import datetime
 from pathlib import Path
 from dotenv import load_dotenv
 from supabase import create_client, Client
+from postgrest.types import ReturnMethod
 import psutil
 
+# Camera stack (only available on the Raspberry Pi)
+try:
+    from picamera2 import Picamera2
+    PICAMERA2_IMPORT_ERROR = None
+except ImportError as e:
+    Picamera2 = None
+    PICAMERA2_IMPORT_ERROR = e
+
 # Load environment variables
 load_dotenv()
 
@@ -40,15 +52,53 @@ class SystemStatusUpdater:
         self.camera_id = os.getenv("CAMERA_ID", "raspberry_pi_camera_1")
         self.base_dir = Path(os.getenv("EZREC_BASE_DIR", "/opt/ezrec-backend"))
         
+        # Resolve camera support once; the import result never changes at runtime
+        self._camera_cls = Picamera2
+        self._camera_import_error = f"error: {str(PICAMERA2_IMPORT_ERROR)[:50]}"
+        
+        self.update_interval = 3  # seconds between status ticks
+        
+        # Status write coalescing: only upsert on change, plus a periodic heartbeat
+        self._last_status = None
+        self._last_status_write = 0.0
+        self.status_heartbeat_interval = 30
+        
+        # Slow-moving metrics are sampled less often than the 3-second status tick
+        self.disk_sample_interval = 60
+        self.memory_sample_interval = 5
+        self.camera_probe_interval = 60
+        self._disk_cache = (float("-inf"), None)
+        self._memory_cache = (float("-inf"), None)
+        self._camera_cache = (float("-inf"), None)
+        self._recorder_proc = None  # last seen main.py process, reused while it lives
+        
+        # Prime the CPU counter so non-blocking cpu_percent() calls measure since the last tick
+        psutil.cpu_percent(interval=None)
+        
         self.logger.info("🔄 System Status Updater initialized")
     
     def setup_logging(self):
         """Setup logging"""
-        logging.basicConfig(
-            level=logging.INFO,
-            format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-            handlers=[logging.StreamHandler(sys.stdout)]
+        # The log format never uses thread/process fields; don't collect them per record
+        logging.logThreads = False
+        logging.logProcesses = False
+        logging.logMultiprocessing = False
+        
+        stream_handler = logging.StreamHandler(sys.stdout)
+        stream_handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+        
+        # The status loop only enqueues records; a listener thread writes them to stdout
+        log_queue = queue.SimpleQueue()
+        self._log_listener = logging.handlers.QueueListener(
+            log_queue, stream_handler, respect_handler_level=True
         )
+        self._log_listener.start()
+        atexit.register(self._log_listener.stop)
+        
+        queue_handler = logging.handlers.QueueHandler(log_queue)
+        queue_handler.setFormatter(logging.Formatter('%(message)s'))
+        
+        logging.basicConfig(level=logging.INFO, handlers=[queue_handler])
         self.logger = logging.getLogger("SystemStatus")
     
     def setup_supabase(self):
@@ -62,35 +112,74 @@ class SystemStatusUpdater:
         self.supabase: Client = create_client(url, key)
         self.logger.info("✅ Supabase client connected")
     
-    def get_system_metrics(self):
-        """Get current system metrics"""
-        try:
-            # CPU and Memory
-            cpu_percent = psutil.cpu_percent(interval=1)
-            memory = psutil.virtual_memory()
-            
-            # Disk usage
+    def _sample_disk(self, now: float):
+        """disk_usage of base_dir, refreshed at most every disk_sample_interval"""
+        sampled_at, disk = self._disk_cache
+        if disk is None or now - sampled_at >= self.disk_sample_interval:
             disk = psutil.disk_usage(str(self.base_dir))
-            
-            # Check camera availability
+            self._disk_cache = (now, disk)
+        return disk
+    
+    def _sample_memory(self, now: float):
+        """virtual_memory, refreshed at most every memory_sample_interval"""
+        sampled_at, memory = self._memory_cache
+        if memory is None or now - sampled_at >= self.memory_sample_interval:
+            memory = psutil.virtual_memory()
+            self._memory_cache = (now, memory)
+        return memory
+    
+    def _probe_camera(self, now: float) -> str:
+        """Camera availability, re-probed at most every camera_probe_interval"""
+        if self._camera_cls is None:
+            return self._camera_import_error
+        
+        probed_at, camera_status = self._camera_cache
+        if camera_status is None or now - probed_at >= self.camera_probe_interval:
+            # Opening the camera initializes libcamera; far too heavy for every tick
             camera_status = "available"
             try:
-                from picamera2 import Picamera2
-                test_cam = Picamera2()
+                test_cam = self._camera_cls()
                 test_cam.close()
             except Exception as e:
                 camera_status = f"error: {str(e)[:50]}"
+            self._camera_cache = (now, camera_status)
+        return camera_status
+    
+    def _recording_process_running(self) -> bool:
+        """Whether the recorder is alive; rescans /proc only after the last known process exits"""
+        # is_running() also checks the create time, so a recycled PID doesn't count
+        if self._recorder_proc is not None and self._recorder_proc.is_running():
+            return True
+        
+        self._recorder_proc = None
+        for proc in psutil.process_iter(['pid', 'name', 'cmdline']):
+            try:
+                cmdline = ' '.join(proc.info['cmdline'] or [])
+                if 'main.py' in cmdline or 'orchestrator.py' in cmdline:
+                    self._recorder_proc = proc
+                    return True
+            except:
+                continue
+        return False
+    
+    def get_system_metrics(self):
+        """Get current system metrics"""
+        try:
+            now = time.monotonic()
+            
+            # CPU since the previous call (non-blocking) and cached memory
+            cpu_percent = psutil.cpu_percent(interval=None)
+            memory = self._sample_memory(now)
+            
+            # Disk usage
+            disk = self._sample_disk(now)
             
             # Check if recording process is running
-            recording_active = False
-            for proc in psutil.process_iter(['pid', 'name', 'cmdline']):
-                try:
-                    cmdline = ' '.join(proc.info['cmdline'] or [])
-                    if 'main.py' in cmdline or 'orchestrator.py' in cmdline:
-                        recording_active = True
-                        break
-                except:
-                    continue
+            recording_active = self._recording_process_running()
+            
+            # Check camera availability; main.py holds the camera for its whole lifetime,
+            # so while it runs a probe could only fail and would misreport a healthy camera
+            camera_status = "in use" if recording_active else self._probe_camera(now)
             
             return {
                 "timestamp": datetime.now().isoformat(),
@@ -110,7 +199,7 @@ class SystemStatusUpdater:
     async def update_status(self):
         """Update system status in database"""
         try:
-            metrics = self.get_system_metrics()
+            metrics = await asyncio.to_thread(self.get_system_metrics)
             
             if not metrics:
                 return
@@ -130,13 +219,25 @@ class SystemStatusUpdater:
                 "is_recording": metrics["recording_process_active"]
             }
             
-            # Upsert to database
-            result = self.supabase.table("system_status").upsert(
+            # Skip the round-trip unless the state changed; CPU/memory/disk readings move
+            # every tick, so they only ride along with the periodic heartbeat
+            status_tuple = (status_data["status"], status_data["camera_status"], status_data["is_recording"])
+            if (status_tuple == self._last_status
+                    and time.monotonic() - self._last_status_write < self.status_heartbeat_interval):
+                return
+            
+            # Upsert to database; the sync client runs in a worker thread so the loop stays free
+            query = self.supabase.table("system_status").upsert(
                 status_data, 
-                on_conflict="user_id,camera_id"
-            ).execute()
+                on_conflict="user_id,camera_id",
+                returning=ReturnMethod.minimal
+            )
+            await asyncio.to_thread(query.execute)
+            self._last_status = status_tuple
+            self._last_status_write = time.monotonic()
             
-            self.logger.info(f"✅ Status updated - CPU: {metrics['cpu_percent']}% | Memory: {metrics['memory_percent']}% | Camera: {metrics['camera_status']}")
+            self.logger.info("✅ Status updated - CPU: %s%% | Memory: %s%% | Camera: %s",
+                             metrics['cpu_percent'], metrics['memory_percent'], metrics['camera_status'])
             
         except Exception as e:
             self.logger.error(f"❌ Failed to update status: {e}")
@@ -145,17 +246,23 @@ class SystemStatusUpdater:
         """Start continuous status monitoring (every 3 seconds)"""
         self.logger.info("🚀 Starting system status monitoring...")
         
+        loop = asyncio.get_running_loop()
+        next_tick = loop.time()
         while True:
             try:
                 await self.update_status()
-                await asyncio.sleep(3)  # Update every 3 seconds
-                
             except KeyboardInterrupt:
                 self.logger.info("🛑 Status monitoring stopped")
                 break
             except Exception as e:
                 self.logger.error(f"❌ Monitoring error: {e}")
-                await asyncio.sleep(3)
+            
+            # Fixed cadence: the update's own duration doesn't stretch the period,
+            # and ticks missed during a slow update are skipped rather than bunched up
+            next_tick += self.update_interval
+            while next_tick < loop.time():
+                next_tick += self.update_interval
+            await asyncio.sleep(next_tick - loop.time())
 
 async def main():
     """Main entry point for standalone usage"""